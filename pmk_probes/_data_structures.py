@@ -3,20 +3,27 @@ import logging
 import struct
 from dataclasses import dataclass, fields, field
 from enum import Enum, auto
-from typing import ClassVar, Any, Union, NamedTuple
+from functools import lru_cache, cached_property
+from typing import ClassVar, Any, Union, NamedTuple, Callable
 
 from crccheck.crc import Crc32Cksum
 
 DATE_FORMAT = "%Y%m%d"
+_F32 = struct.Struct('<f')  # float fields are stored as little-endian IEEE 754 single precision
+_META_DELETE = b"\xFF?"  # padding bytes of sequential metadata, removed before splitting it into fields
 
 
+def _text_parser(convert: Callable[[str], Any]) -> Callable[[bytes], Any]:
+    """Return a parser that decodes a text field and converts it using convert. Empty fields are parsed as None."""
+    def parse(field_value: bytes) -> Any:
+        decoded = field_value.replace(b"\xff", b"").decode("utf-8")
+        return convert(decoded) if decoded else None
+    return parse
 
 
-def _batched_string(string: bytes, batch_size: int):
-    """Return a generator that yields batches of size batch_size of the string."""
-    for i in range(0, len(string), batch_size):
-        yield string[i:i + batch_size]
-
+class _FieldCodec(NamedTuple):
+    parse: Callable[[bytes], Any]  # converts the field's bytes to its value
+    unparse: Callable[[Any], bytes]  # converts the field's value (never None) to its bytes
 
 
 class UserMapping:
@@ -24,9 +31,11 @@ class UserMapping:
     from user values to descriptors. """
 
     def __init__(self, user_to_internal: dict[int | str, int | str]):
-        if len(set(user_to_internal.values())) != len(user_to_internal):
-            logging.warning("The mapping is not bijective.")
         self.user_to_internal = user_to_internal
+        self._internal_to_user = {v: k for k, v in user_to_internal.items()}  # inverted once, not on every lookup
+        self._internal_values_set = frozenset(self._internal_to_user)
+        if len(self._internal_to_user) != len(user_to_internal):  # duplicate internal values collapsed
+            logging.warning("The mapping is not bijective.")
 
     @property
     def internal_to_user(self) -> dict:
@@ -36,10 +45,10 @@ class UserMapping:
         Returns:
             The inverted dictionary.
         """
-        return {v: k for k, v in self.user_to_internal.items()}
+        return self._internal_to_user
 
     def get_user_value(self, internal_value: int):
-        return self.internal_to_user[internal_value]
+        return self._internal_to_user[internal_value]
 
     def get_internal_value(self, user_value: Any) -> int:
         return self.user_to_internal[user_value]
@@ -56,9 +65,18 @@ class UserMapping:
     def internal_values(self):
         return self.user_to_internal.values()
 
+    @property
+    def internal_values_set(self) -> frozenset:
+        """ The internal values as a set, for constant time membership tests. """
+        return self._internal_values_set
+
     def __iter__(self):
         return iter(self.user_to_internal)
 
+    def __contains__(self, user_value) -> bool:
+        """ Membership of user values, looked up in the dictionary instead of iterating over it. """
+        return user_value in self.user_to_internal
+
 
 # dictionary of UUIDs and their corresponding probe models
 # the key has to be the class name of the probe and the value is the UUID of the probe
@@ -98,43 +116,54 @@ class PMKMetadata:
     uuid: str
     page_size: ClassVar[int] = 16
     num_pages: ClassVar[int] = 16
+    _blank_image: ClassVar[bytes] = b"\x3F" * (page_size * num_pages)  # unused EEPROM space is filled with 0x3F
     metadata_bytes: ClassVar[bytes]
 
     def __post_init__(self):
-        if self.uuid not in UUIDs.internal_values:
+        if self.uuid not in UUIDs.internal_values_set:
             self.uuid = ""
 
     def __eq__(self, other):
         """ Metadata is equal if byte representation is equal """
         return self.to_bytes() == other.to_bytes()
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        self.__dict__.pop("_encoded", None)  # any change to the metadata invalidates its cached byte representation
+
     @classmethod
     def from_bytes(cls, metadata: bytes) -> Union["PMKMetadata", None]:
         cls.metadata_bytes = metadata
+        metadata_fields = cls._split_fields(metadata)
         values = {}
-        for i, field in enumerate(fields(cls)):
-            if field.init is False:
-                continue
+        for i, field_name, parse in cls._parse_plan():
             try:
-                field_value = cls._get_field_value(metadata, i, field.name)
-                values[field.name] = cls._parse_field(field, field_value)
+                values[field_name] = parse(cls._get_field_value(metadata_fields, i, field_name))
             except struct.error:
-                values[field.name] = None
+                values[field_name] = None
             except IndexError as e:
                 raise ValueError("Error parsing metadata.") from e
         return cls(**values)
 
     @classmethod
-    def _get_field_value(cls, metadata: bytes, k: int, field_name: str) -> bytes:
-        """ Get the value of a field from the metadata using the traditional sequential evaluation of fields.
+    def _split_fields(cls, metadata: bytes) -> list[bytes]:
+        """ Split the metadata into its fields once, so that they can be looked up by _get_field_value.
 
         :param metadata: The metadata as a bytes object.
+        :return: The fields of the metadata separated by "\n", with padding bytes removed.
+        """
+        return metadata.translate(None, _META_DELETE).split(b"\n")
+
+    @classmethod
+    def _get_field_value(cls, metadata_fields: list[bytes], k: int, field_name: str) -> bytes:
+        """ Get the value of a field from the metadata using the traditional sequential evaluation of fields.
+
+        :param metadata_fields: The metadata as returned by _split_fields.
         :param k: The index of the field in the metadata.
         :param field_name: The name of the field.
         :return: The kth field of the metadata separated by "\n".
         """
-        metadata_list = metadata.replace(b"\xFF", b"").replace(b"?", b"").split(b"\n")
-        return metadata_list[k]
+        return metadata_fields[k]
 
     @classmethod
     def parse_datetime(cls, decoded):
@@ -144,55 +173,61 @@ class PMKMetadata:
             return None
 
     @classmethod
-    def _parse_field(cls, field, field_value: str | bytes):
-        # check if type of field is float:
-        if field.type == float:
-            return struct.unpack('f', field_value)[0]
-        if field.type == bytes:
-            return field_value
-        match field_value.replace(b"\xff", b"").decode("utf-8"), field.type:
-            case "", _:
-                return None
-            case decoded, datetime.date:
-                return cls.parse_datetime(decoded)
-            case decoded, _:
-                if field.type == datetime.date | None:
-                    return cls.parse_datetime(decoded)
-                return field.type(decoded)
-        return None
-
-    def to_bytes(self):
+    @lru_cache
+    def _field_codecs(cls) -> dict[str, _FieldCodec]:
+        """ Select the parse and unparse functions of every field based on its type, once per class. """
+        codecs = {}
+        for field in fields(cls):
+            if field.type == float:
+                codecs[field.name] = _FieldCodec(lambda b: _F32.unpack(b)[0], _F32.pack)
+            elif field.type == bytes:
+                codecs[field.name] = _FieldCodec(lambda b: b, lambda v: v)
+            elif field.type in (datetime.date, datetime.date | None):
+                codecs[field.name] = _FieldCodec(_text_parser(cls.parse_datetime),
+                                                 lambda v: v.strftime(DATE_FORMAT).encode("ascii"))
+            else:
+                codecs[field.name] = _FieldCodec(_text_parser(field.type), lambda v: str(v).encode("ascii"))
+        return codecs
+
+    @classmethod
+    @lru_cache
+    def _parse_plan(cls) -> tuple[tuple[int, str, Callable[[bytes], Any]], ...]:
+        """ Index, name and parse function of every field that is read by from_bytes, once per class. """
+        codecs = cls._field_codecs()
+        return tuple((i, field.name, codecs[field.name].parse) for i, field in enumerate(fields(cls)) if field.init)
+
+    def to_bytes(self) -> bytes:
+        """ Return the byte representation of the metadata. It is computed once and cached until a field changes. """
+        return self._encoded
+
+    @cached_property
+    def _encoded(self) -> bytes:
+        return self._encode()
+
+    def _encode(self) -> bytes:
         values = []
         for field in fields(self):
             field_value = getattr(self, field.name)
-            values.append(self._unparse_field(field_value))
+            values.append(self._unparse_field(field.name, field_value))
         metadata_str = b"\n".join(values) + b"\n"
         # fill the rest with 0x3F
-        metadata_str += b"\x3F" * (self.page_size * self.num_pages - len(metadata_str))
-        return metadata_str
+        return metadata_str + self._blank_image[len(metadata_str):]
 
     @classmethod
-    def _unparse_field(cls, field_value, field_length=None) -> bytes:
-        match field_value:
-            case bytes():
-                byte_field = field_value
-            case None:
-                byte_field = b''
-            case float():
-                byte_field = struct.pack('f', field_value)
-            case datetime.date():
-                byte_field = field_value.strftime(DATE_FORMAT).encode("ascii")
-            case str():
-                byte_field = field_value.encode("ascii")
-            case _:
-                raise TypeError(f"Unexpected type {type(field_value)}")
+    def _unparse_field(cls, field_name: str, field_value, field_length=None) -> bytes:
+        if field_value is None:
+            byte_field = b''
+        else:
+            byte_field = cls._field_codecs()[field_name].unparse(field_value)
         if field_length:
             byte_field += b"\0" * (field_length - len(byte_field))
         return byte_field
 
-    def as_pages(self):
-        metadata_bytes = self.to_bytes()
-        return list(_batched_string(metadata_bytes, self.page_size))
+    def as_pages(self) -> list[memoryview]:
+        """ Split the metadata into EEPROM pages. The pages are zero-copy views of to_bytes(), use tobytes() on a page
+        if a bytes object is needed. """
+        metadata_bytes = memoryview(self.to_bytes())
+        return [metadata_bytes[i:i + self.page_size] for i in range(0, len(metadata_bytes), self.page_size)]
 
 
 @dataclass
@@ -205,15 +240,48 @@ class MappedMetadata(PMKMetadata):
         self.crc32 = self.checksum().to_bytes(byteorder="big", length=4)
 
     @classmethod
-    def _get_field_value(cls, metadata: bytes, k: int, field_name: str, pad=0xFF) -> bytes:
-        """ Get the value of a field from the metadata.
+    def _split_fields(cls, metadata: bytes) -> dict[str, bytes]:
+        """ Unpack all fields of the metadata in a single call using the struct of its EEPROM layout revision.
+
         :param metadata: The metadata as a bytes object.
+        :return: The raw bytes of every field in the metadata map, by field name.
+        """
+        layout_revision = metadata[0x04:0x07]  # layout revision is stored at 0x04-0x06
+        layout, field_names = cls._layout_struct(layout_revision)
+        if len(metadata) >= layout.size:
+            return dict(zip(field_names, layout.unpack_from(metadata)))
+        # metadata shorter than the layout is sliced field by field, fields reaching past its end are cut short or
+        # empty, which parses incomplete floats and empty fields as None
+        return {field_name: metadata[address:address + length]
+                for field_name, (address, length) in cls.metadata_maps[layout_revision].items()}
+
+    @classmethod
+    @lru_cache
+    def _layout_struct(cls, layout_revision: bytes) -> tuple[struct.Struct, tuple[str, ...]]:
+        """ Build a struct for the metadata map of a layout revision, with pad bytes between the fields.
+
+        :param layout_revision: The EEPROM layout revision as stored in the metadata.
+        :return: The struct and the names of the fields it unpacks, in order.
+        """
+        meta_map = sorted(cls.metadata_maps[layout_revision].items(), key=lambda item: item[1][0])
+        layout_format = "<"
+        current_address = 0
+        for _, (address, length) in meta_map:
+            if address > current_address:
+                layout_format += f"{address - current_address}x"
+            layout_format += f"{length}s"
+            current_address = address + length
+        return struct.Struct(layout_format), tuple(field_name for field_name, _ in meta_map)
+
+    @classmethod
+    def _get_field_value(cls, metadata_fields: dict[str, bytes], k: int, field_name: str) -> bytes:
+        """ Get the value of a field from the metadata.
+        :param metadata_fields: The metadata as returned by _split_fields.
         :param k: The index of the field in the metadata.
         :param field_name: The name of the field.
         :return: The field value of the metadata entry with name field_name.
         """
-        address, length = cls.metadata_maps[metadata[0x04:0x07]][field_name]  # layout revision is stored at 0x04-0x06
-        return metadata[address:address + length]
+        return metadata_fields[field_name]
 
     def to_fields(self) -> list[tuple[int, Any]]:
         values = []
@@ -221,10 +289,10 @@ class MappedMetadata(PMKMetadata):
         for field in fields(self):
             field_value = getattr(self, field.name)
             address, length = meta_map[field.name]
-            values.append((address, self._unparse_field(field_value, length)))
+            values.append((address, self._unparse_field(field.name, field_value, length)))
         return values
 
-    def to_bytes(self):
+    def _encode(self) -> bytes:
         return self.crc32 + self.to_bytes_no_crc()
 
     def to_bytes_no_crc(self):
@@ -238,7 +306,7 @@ class MappedMetadata(PMKMetadata):
             field = next(f for f in fields(self) if f.name == field_name)
             if field.init is False:
                 continue
-            field_string = self._unparse_field(getattr(self, field_name))
+            field_string = self._unparse_field(field_name, getattr(self, field_name))
             byte_string += field_string  # some payloads cannot be converted to strings
             current_address = address + len(field_string)
         return byte_string
@@ -1,3 +1,4 @@
+import binascii
 import logging
 from abc import abstractmethod
 from enum import Enum
@@ -47,6 +48,7 @@ class PMKDevice:
         self.channel = channel
         self.verbose = verbose
         self._serial_number = None
+        self._prefetched_metadata = None  # metadata that was already read by someone else, used instead of reading it
         self._simulated = simulated
         self._simulated_interface = EchoInterface()
 
@@ -64,9 +66,19 @@ class PMKDevice:
         """
         Helper function to read the metadata of the probe and cache it for later use. Cache can be cleared using
         _read_metadata.cache_clear() to force a re-read."""
+        if (metadata := self._take_prefetched_metadata()) is not None:
+            return metadata
         query = self._query("RD", i2c_address=self._i2c_addresses['metadata'], command=0x00, length=0xFF)
         return PMKMetadata.from_bytes(query)
 
+    def _take_prefetched_metadata(self) -> PMKMetadata | None:
+        """
+        Return the prefetched metadata, if any, and forget it. _read_metadata returns it instead of reading the
+        metadata, so that it is cached like read metadata and cache_clear() still forces a re-read.
+        """
+        metadata, self._prefetched_metadata = self._prefetched_metadata, None
+        return metadata
+
     @property
     def metadata(self) -> PMKMetadata:
         """
@@ -106,25 +118,27 @@ class PMKDevice:
         """
         if wr_rd != "RD" and not payload:
             return None  # don't try to send an empty payload
-        self._interface.reset_input_buffer()  # Clear input buffer in case it wasn't empty
-        cmd = f"{command:04X}{length:02X}"
-        string = f"\x02{wr_rd}{self.channel.value}{i2c_address:02X}{self._addressing}{cmd}"
-        if payload is not None:
-            string += payload.hex().upper()  # 2 hex digits per byte
-        string += "\x03"
-        # write the command
-        self._interface.write(string.encode())
-        logging.info(f"Sent: {string}")
-        # read the response and ensure it's correct: (STX, ACK, echo, read_payload, ETX, CR)
-        self._expect([STX, ACK, f"{self.channel.value}{cmd}".encode()])
-        # read the payload
-        if wr_rd == "RD":
-            # length here means number of bytes, not number of characters
-            # decoding (decode()) and creating new bytes (fromhex) is required to get rid of doubly encoded characters
-            read_payload = bytes.fromhex(self._interface.read(length * 2).decode())
-        else:
-            # no payload is returned for WR commands
-            read_payload = None
-        logging.info(f"Received: {read_payload}")
-        self._expect([ETX, CR])
-        return read_payload
+        # a command and its response must not interleave with those of other threads, all channels share one interface
+        with self._interface.lock:
+            self._interface.reset_input_buffer()  # Clear input buffer in case it wasn't empty
+            cmd = f"{command:04X}{length:02X}"
+            string = f"\x02{wr_rd}{self.channel.value}{i2c_address:02X}{self._addressing}{cmd}"
+            if payload is not None:
+                string += payload.hex().upper()  # 2 hex digits per byte
+            string += "\x03"
+            # write the command
+            self._interface.write(string.encode())
+            logging.info(f"Sent: {string}")
+            # read the response and ensure it's correct: (STX, ACK, echo, read_payload, ETX, CR)
+            self._expect([STX, ACK, f"{self.channel.value}{cmd}".encode()])
+            # read the payload
+            if wr_rd == "RD":
+                # length here means number of bytes, not number of characters
+                # the payload is hex encoded (2 characters per byte), unhexlify decodes it straight from the read buffer
+                read_payload = binascii.unhexlify(self._interface.read(length * 2))
+            else:
+                # no payload is returned for WR commands
+                read_payload = None
+            logging.info(f"Received: {read_payload}")
+            self._expect([ETX, CR])
+            return read_payload
@@ -1,4 +1,5 @@
 import re
+import threading
 from abc import ABCMeta, abstractmethod
 
 import serial
@@ -11,6 +12,9 @@ class HardwareInterface(metaclass=ABCMeta):
 
     def __init__(self, connection_info: dict[str, str]):
         self.connection_info = connection_info  # ip_address/com_port depending on the _interface
+        # held for a whole command/response exchange (see PMKDevice._query) and re-entrantly around sequences of
+        # exchanges that must not be interleaved with other queries, e.g. setting a read pointer and reading from it
+        self.lock = threading.RLock()
 
     def __repr__(self):
         return f"{self.connection_info}"
@@ -1,24 +1,67 @@
 """This module contains the classes for the PMK power supplies."""
 import http.client
 import re
+import selectors
 import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
 from typing import TypeVar, Any
 
 import serial
 import serial.tools.list_ports
 
+from ._data_structures import PMKMetadata, UUIDs
 from ._devices import PMKDevice, Channel
 from ._errors import ProbeReadError, ProbeConnectionError
 from ._hardware_interfaces import HardwareInterface, SerialInterface
 
 PowerSupplyType = TypeVar("PowerSupplyType", bound="_PMKPowerSupply")
 
+_PS_USB_IDS = {(0x0403, 0x6001)}  # (VID, PID) of the FTDI USB-to-serial converter in the power supplies
+_DISCOVERY_BROADCASTS = 3  # the discovery datagram is repeated, so that a single lost datagram doesn't hide a device
+_DISCOVERY_BROADCAST_INTERVAL = 0.05  # time in s between repeated discovery datagrams
+_DISCOVERY_TIMEOUT = 0.2  # time in s after the first broadcast to wait for replies
+_DISCOVERY_QUIET_TIME = 0.1  # time in s without a new reply after which the wait ends early
+_HTTP_TIMEOUT = 1.0  # time in s after which a power supply that does not serve its XML metadata is skipped
+_LAN_MODEL_TTL = 5.0  # time in s for which the model read from a power supply's XML metadata is reused
+_ENUMERATION_TTL = 3.0  # time in s for which the enumerated COM ports and IP addresses of power supplies are reused
+_usb_power_supply_types: dict[tuple[str, str | None], type] = {}  # (COM port, USB serial number) -> attached model
+_lan_models: dict[str, tuple[float, str]] = {}  # IP address -> (time.monotonic() of the HTTP request, model)
+_enumerations: dict[str, tuple[float, list]] = {}  # enumeration function name -> (time.monotonic() of the call, result)
+
+# extracts model and serial number from PowerSupplyMetadata.xml in one anchored pass, regardless of tag order
+_PS_METADATA_RE = re.compile(rb"(?=.*?<Model>([\w-]{5})</Model>)(?=.*?<SerialNumber>(\d{4})</SerialNumber>)", re.S)
+# position of every field in the sequential metadata by field name, used to read single fields from its first bytes
+_METADATA_FIELD_INDICES = {field_name: i for i, field_name, _ in PMKMetadata._parse_plan()}
+
+
+@lru_cache
+def _supported_probe_types() -> set[type]:
+    """All probe classes, imported on first use to avoid circular imports."""
+    from .probes import _ALL_PMK_PROBES
+    return _ALL_PMK_PROBES
+
+
+@lru_cache
+def _detectable_probe_types() -> tuple[type, ...]:
+    """One probe class per metadata format, used by connected_probes to read the metadata of a channel, in order."""
+    from .probes import BumbleBee2kV, HSDP2010, FireFly
+    return BumbleBee2kV, HSDP2010, FireFly
+
+
+@lru_cache
+def _probe_types_by_uuid() -> dict[str, type]:
+    """All probe classes by the UUID stored in their metadata."""
+    return {UUIDs.get_internal_value(cls.__name__): cls for cls in _supported_probe_types() if cls.__name__ in UUIDs}
+
 
 class _PMKPowerSupply(PMKDevice):
     """The class that controls access to the serial resource of the PMK power supply."""
     _i2c_addresses: dict[str, int] = {"metadata": 0x04}
     _addressing = "W"
     _num_channels = None
+    _identity_length = 0x40  # number of metadata bytes that hold layout revision, serial number, manufacturer and model
 
     def __init__(self, com_port: str = None, ip_address: str = None, verbose: bool = False):
         if com_port:
@@ -28,9 +71,8 @@ class _PMKPowerSupply(PMKDevice):
         else:
             raise ValueError("No connection information provided")
         super().__init__(channel=Channel.PS_CH, verbose=verbose)
-        from .probes import _ALL_PMK_PROBES  # to avoid circular imports
-        self.supported_probe_types = _ALL_PMK_PROBES
         self.interface = interface
+        self.supported_probe_types = _supported_probe_types()  # resolved once per process, can be narrowed per instance
 
     def __repr__(self):
         if self._serial_number:
@@ -39,6 +81,34 @@ class _PMKPowerSupply(PMKDevice):
             sn_part = ""
         return f"{self.__class__.__name__}({sn_part}{next(iter(self._interface.connection_info))}={self._interface.connection_info})"
 
+    def _read_identity(self) -> tuple[str, str]:
+        """
+        Read the model and serial number of the power supply. Both are stored at the start of the metadata, so only
+        its first bytes are queried instead of the whole EEPROM. Falls back to the full metadata if the model does not
+        end within these bytes.
+
+        :return: The model and the serial number.
+        """
+        query = self._query("RD", i2c_address=self._i2c_addresses['metadata'], command=0x00,
+                            length=self._identity_length)
+        metadata_fields = PMKMetadata._split_fields(query)
+        model_index, serial_number_index = _METADATA_FIELD_INDICES["model"], _METADATA_FIELD_INDICES["serial_number"]
+        if len(metadata_fields) > max(model_index, serial_number_index) + 1:  # both fields are terminated by "\n"
+            model, serial_number = metadata_fields[model_index].decode(), metadata_fields[serial_number_index].decode()
+        else:
+            model, serial_number = self.metadata.model, self.metadata.serial_number
+        self._serial_number = serial_number
+        return model, serial_number
+
+    def _probe_identity(self) -> tuple[str, str]:
+        """Read the model and serial number of the power supply and close the connection again."""
+        try:
+            return self._read_identity()
+        except ValueError as e:
+            raise ProbeConnectionError(f"Could not read the identity of {repr(self)}.") from e
+        finally:
+            self.close()
+
     @property
     def _interface(self) -> "HardwareInterface":
         if self._simulated:
@@ -49,20 +119,38 @@ class _PMKPowerSupply(PMKDevice):
     @property
     def connected_probes(self) -> tuple[Any, ...]:
         """Show all connected probes for this power supply."""
-        from .probes import BumbleBee2kV, HSDP2010, FireFly
-        to_try = [BumbleBee2kV, HSDP2010, FireFly]
         connected_probes = []
         for channel in [Channel(i) for i in range(1, self._num_channels + 1)]:
-            # for every channel, query the probe for its metadata
-            for ProbeType in to_try:
-                try:
-                    detected_probe = ProbeType(self, channel, allow_legacy=False)
-                    connected_probes.append(detected_probe)
-                    break
-                except (ProbeReadError, ProbeConnectionError, KeyError):
-                    continue
+            detected_probe = self._detect_probe(channel)
+            if detected_probe is not None:
+                connected_probes.append(detected_probe)
         return tuple(connected_probes)
 
+    def _detect_probe(self, channel: Channel) -> Any:
+        """
+        Detect the probe connected to a channel. The metadata is read once per metadata format until it contains a
+        known UUID, which then selects the probe class directly instead of trying every class in turn.
+
+        :return: The detected probe or None if no probe was detected.
+        """
+        for reader_type in _detectable_probe_types():
+            try:
+                metadata = reader_type(self, channel, skip_metadata=True).metadata
+            except (ProbeReadError, ProbeConnectionError, KeyError):
+                continue
+            probe_type = _probe_types_by_uuid().get(metadata.uuid)
+            if probe_type is None:
+                continue
+            # the detected probe reuses the metadata if it reads it the same way, instead of reading it again
+            same_source = all(getattr(probe_type, attr) == getattr(reader_type, attr)
+                              for attr in ("_read_metadata", "_i2c_addresses", "_addressing"))
+            try:
+                return probe_type(self, channel, allow_legacy=False,
+                                  _prefetched_metadata=metadata if same_source else None)
+            except (ProbeReadError, ProbeConnectionError, KeyError):
+                continue
+        return None
+
     # def device_at_channel(self, channel: Channel) -> PMKDevice:
     #     """
     #     Returns:
@@ -97,72 +185,140 @@ class PS08(_PMKPowerSupply):
     _num_channels = 8  # the PS08 has 8 channels
 
 
+_POWER_SUPPLY_TYPES: dict[str, type] = {"PS-02": PS02, "PS-03": PS03, "PS-08": PS08}  # model -> class
+
+
+def _power_supply_type(model: str) -> type:
+    """Return the class of the power supply model."""
+    try:
+        return _POWER_SUPPLY_TYPES[model]
+    except KeyError:
+        raise ValueError(f"Unknown model {model}")
+
+
 def _auto_ps(model=None, **kwargs) -> PowerSupplyType:
     """Automatically find a power supply and return it."""
-    if not model:
-        model_getter_ps = PS03(**kwargs)
-        try:
-            model = model_getter_ps.metadata.model
-            model_getter_ps.close()
-        except ProbeConnectionError:
-            raise ProbeConnectionError(f"Couldn't open connection power supply with details {kwargs}. "
-                                       f"Is it in use by another program?")
-    match model:
-        case "PS-02":
-            return PS02(**kwargs)
-        case "PS-03":
-            return PS03(**kwargs)
-        case "PS-08":
-            return PS08(**kwargs)
-        case _:
-            raise ValueError(f"Unknown model {model}")
-
-
-def _find_power_supplies_usb() -> list[PowerSupplyType]:
+    if model:
+        return _power_supply_type(model)(**kwargs)
+    try:
+        model, serial_number = PS03(**kwargs)._probe_identity()  # reading the model works the same for every model
+    except ProbeConnectionError:
+        raise ProbeConnectionError(f"Couldn't open connection power supply with details {kwargs}. "
+                                   f"Is it in use by another program?")
+    ps = _power_supply_type(model)(**kwargs)
+    ps._serial_number = serial_number  # already read, shown by repr
+    return ps
+
+
+def _cached_enumeration(enumerate_power_supplies):
+    """Reuse the result of an enumeration for _ENUMERATION_TTL seconds, unless the call is made with force=True."""
+    @wraps(enumerate_power_supplies)
+    def wrapper(force: bool = False) -> list:
+        now = time.monotonic()
+        called_at, result = _enumerations.get(enumerate_power_supplies.__name__, (None, None))
+        if force or called_at is None or now - called_at >= _ENUMERATION_TTL:
+            result = enumerate_power_supplies()
+            _enumerations[enumerate_power_supplies.__name__] = (now, result)
+        return list(result)
+    return wrapper
+
+
+@_cached_enumeration
+def _enumerate_usb() -> list[tuple[str, str | None]]:
+    """Return COM port and USB serial number of every attached FTDI device a power supply can be connected to."""
     devices = serial.tools.list_ports.comports()
-    power_supplies = []
-    for device in devices:
-        match device.vid, device.pid:
-            case 1027, 24577:
-                power_supplies.append(_auto_ps(com_port=device.device))
-            case _:
-                pass
-    return power_supplies
+    return [(device.device, device.serial_number) for device in devices if (device.vid, device.pid) in _PS_USB_IDS]
+
+
+def _find_power_supplies_usb(force: bool = False) -> list[PowerSupplyType]:
+    usb_keys = _enumerate_usb(force=force)
+    if force:
+        _usb_power_supply_types.clear()
+    # forget unplugged devices, so that whatever is attached to their port next is read again
+    for usb_key in _usb_power_supply_types.keys() - set(usb_keys):
+        _usb_power_supply_types.pop(usb_key, None)
+    # only devices that were not seen before are read, dominated by serial I/O, so the ports are queried concurrently
+    new_keys = [usb_key for usb_key in usb_keys if usb_key not in _usb_power_supply_types]
+    with ThreadPoolExecutor(max_workers=max(len(new_keys), 1)) as executor:
+        new_power_supplies = dict(zip(new_keys, executor.map(lambda key: _auto_ps(com_port=key[0]), new_keys)))
+    for usb_key, ps in new_power_supplies.items():
+        _usb_power_supply_types[usb_key] = type(ps)
+    return [new_power_supplies.get(usb_key) or _usb_power_supply_types[usb_key](com_port=usb_key[0])
+            for usb_key in usb_keys]
 
 
-def _find_power_supplies_lan() -> list[PowerSupplyType]:
+@_cached_enumeration
+def _enumerate_lan() -> list[str]:
+    """Return the IP address of every power supply that answers the LAN discovery broadcast."""
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        sock.bind((socket.gethostbyname(socket.gethostname()), 30718))
-        sock.settimeout(1)
-        sock.sendto(b'\x00\x00\x00\xf6', ('<broadcast>', 30718))
-        ps_ips = []
-        # Receive response
-        while True:
-            try:
+        sock.bind(("0.0.0.0", 30718))  # all interfaces, avoids resolving the host name on every call
+        sock.setblocking(False)
+        deadline = time.monotonic() + _DISCOVERY_TIMEOUT
+        for i in range(_DISCOVERY_BROADCASTS):  # replies arriving in between are buffered by the socket
+            if i:
+                time.sleep(_DISCOVERY_BROADCAST_INTERVAL)
+            sock.sendto(b'\x00\x00\x00\xf6', ('<broadcast>', 30718))
+        ps_ips = {}  # used as an ordered set, every broadcast is answered
+        # Receive responses as soon as they are ready, until the time budget is used up and no new reply came in for
+        # the quiet time
+        with selectors.DefaultSelector() as selector:
+            selector.register(sock, selectors.EVENT_READ)
+            while selector.select(max(deadline - time.monotonic(), 0)):
                 data, addr = sock.recvfrom(1024)
-                if data.startswith(b'\x00\x00\x00\xf7'):
-                    ps_ips.append(addr[0])
-            except socket.timeout:
-                break
-    full_info_list = []
-    # read XML metadata from the power supplies' IP addresses by creating an HTTP request
-    for ip in ps_ips:
-        try:
-            conn = http.client.HTTPConnection(ip)
-            conn.request("GET", "/PowerSupplyMetadata.xml")
-            text = conn.getresponse().read().decode()
-            patterns = {"model": r"<Model>([\w-]{5})</Model>", "serial_number": r"<SerialNumber>(\d{4})</SerialNumber>"}
-            metadata = {key: re.search(pattern, text).group(1) for key, pattern in patterns.items()}
-            full_info_list.append(_auto_ps(model=metadata["model"], ip_address=ip))
-        except (OSError, AttributeError):
-            pass
-    return full_info_list
-
-
-def find_power_supplies() -> dict[str, list[PowerSupplyType]]:
-    return {'USB': _find_power_supplies_usb(), 'LAN': _find_power_supplies_lan()}
+                if data.startswith(b'\x00\x00\x00\xf7') and addr[0] not in ps_ips:
+                    ps_ips[addr[0]] = None
+                    deadline = max(deadline, time.monotonic() + _DISCOVERY_QUIET_TIME)
+    return list(ps_ips)
+
+
+def _find_power_supplies_lan(force: bool = False) -> list[PowerSupplyType]:
+    ps_ips = _enumerate_lan(force=force)
+    if force:
+        _lan_models.clear()
+    # read XML metadata from the power supplies' IP addresses concurrently, the requests are network-bound
+    with ThreadPoolExecutor(max_workers=min(16, max(len(ps_ips), 1))) as executor:
+        return [ps for ps in executor.map(_fetch_lan_power_supply, ps_ips) if ps is not None]
+
+
+def _fetch_lan_power_supply(ip: str) -> PowerSupplyType | None:
+    """Return the power supply at ip. Its model is read from the XML metadata unless that was done recently."""
+    fetched_at, model = _lan_models.get(ip, (None, None))
+    if fetched_at is None or time.monotonic() - fetched_at >= _LAN_MODEL_TTL:
+        model = _fetch_lan_model(ip)
+        if model is None:
+            return None
+        _lan_models[ip] = (time.monotonic(), model)
+    # the XML metadata is authoritative, so the power supply is created without querying it again
+    ps_type = _POWER_SUPPLY_TYPES.get(model)
+    return ps_type(ip_address=ip) if ps_type else None
+
+
+def _fetch_lan_model(ip: str) -> str | None:
+    """Read the model from the XML metadata of the power supply at ip by creating an HTTP request."""
+    conn = http.client.HTTPConnection(ip, timeout=_HTTP_TIMEOUT)
+    try:
+        conn.request("GET", "/PowerSupplyMetadata.xml")
+        match = _PS_METADATA_RE.match(conn.getresponse().read())
+    except (OSError, http.client.HTTPException):  # unreachable, or the response is not valid HTTP
+        return None
+    finally:
+        conn.close()
+    if not match:  # not the metadata of a PMK power supply
+        return None
+    return match.group(1).decode()
+
+
+def find_power_supplies(force: bool = False) -> dict[str, list[PowerSupplyType]]:
+    """
+    Find all power supplies connected via USB or LAN. Discovery results are reused for a few seconds, so that polling
+    this function is cheap.
+
+    :param force: Discard all cached discovery results and query every power supply again.
+    :return: The found power supplies by connection type.
+    """
+    return {'USB': _find_power_supplies_usb(force), 'LAN': _find_power_supplies_lan(force)}
 
 
 if __name__ == "__main__":
@@ -11,7 +11,8 @@ from inspect import isabstract
 from pathlib import Path
 from typing import Literal, TypeVar, cast, Callable
 
-from ._data_structures import UUIDs, UserMapping, FireFlyMetadata, PMKProbeProperties, LED, PowerOverFiberMetadata
+from ._data_structures import (UUIDs, UserMapping, FireFlyMetadata, PMKProbeProperties, LED, PowerOverFiberMetadata,
+                               PMKMetadata)
 from ._devices import PMKDevice, Channel, DUMMY
 from ._errors import ProbeTypeError, UUIDReadError
 from ._hardware_interfaces import HardwareInterface
@@ -40,8 +41,9 @@ class _PMKProbe(PMKDevice, metaclass=ABCMeta):
 
     def __init__(self, power_supply: _PMKPowerSupply, channel: Channel, verbose: bool = False,
                  allow_legacy: bool = False,
-                 simulated=None, skip_metadata=False):
+                 simulated=None, skip_metadata=False, _prefetched_metadata: PMKMetadata | None = None):
         super().__init__(channel, verbose=verbose)
+        self._prefetched_metadata = _prefetched_metadata  # e.g. read by connected_probes while detecting the probe
         self.probe_model = self.__class__.__name__
         self.power_supply = power_supply
         self.channel = channel
@@ -129,6 +131,17 @@ class _PMKProbe(PMKDevice, metaclass=ABCMeta):
         """
         return self._query("RD", self._i2c_addresses["unified"], command, length=bytes_to_read)
 
+    def _read_at_pointer(self, i2c_address: int, pointer_command: int, pointer_payload: bytes, read_command: int,
+                         length: int) -> bytes:
+        """
+        Set a read pointer with a WR command and read from it with an RD command. The interface stays locked in
+        between, so that no other query can move the pointer before it is read from.
+        """
+        with self._interface.lock:
+            self._query("WR", i2c_address=i2c_address, command=pointer_command, payload=pointer_payload,
+                        length=len(pointer_payload))
+            return self._query("RD", i2c_address=i2c_address, command=read_command, length=length)
+
 
 class _BumbleBee(_PMKProbe, metaclass=ABCMeta):
     """Abstract base class for the BumbleBee probes."""
@@ -674,10 +687,10 @@ class PowerOverFiber(_PMKProbe):
 
     @lru_cache
     def _read_metadata(self) -> PowerOverFiberMetadata:
-        self._query("WR", i2c_address=self._i2c_addresses['metadata'], command=0x0C01, payload=DUMMY * 2, length=0x02)
+        if (metadata := self._take_prefetched_metadata()) is not None:
+            return metadata
         return PowerOverFiberMetadata.from_bytes(
-            self._query("RD", i2c_address=self._i2c_addresses['metadata'], command=0x1000,
-                        length=0xC1))
+            self._read_at_pointer(self._i2c_addresses['metadata'], 0x0C01, DUMMY * 2, 0x1000, length=0xC1))
 
     @property
     def echo_value(self):
@@ -946,17 +959,11 @@ class PowerOverFiber(_PMKProbe):
         error_log_data = bytearray()
         for offset in range(0, self._error_log_size, chunk_size):
             current_chunk_size = min(chunk_size, self._error_log_size - offset)
-            self._query(
-                "WR",
-                i2c_address=self._i2c_addresses['unified'],
-                command=0x0C02,
-                payload=offset.to_bytes(2, byteorder='big'),
-                length=2
-            )
-            chunk = self._query(
-                "RD",
-                i2c_address=self._i2c_addresses['unified'],
-                command=0x1001,
+            chunk = self._read_at_pointer(
+                self._i2c_addresses['unified'],
+                pointer_command=0x0C02,
+                pointer_payload=offset.to_bytes(2, byteorder='big'),
+                read_command=0x1001,
                 length=current_chunk_size
             )
             error_log_data.extend(chunk)
@@ -999,9 +1006,10 @@ class FireFly(_PMKProbe):
 
     @lru_cache
     def _read_metadata(self) -> FireFlyMetadata:
-        self._query("WR", i2c_address=self._i2c_addresses['metadata'], command=0x0C01, payload=b'\x00' * 2, length=0x02)
-        return FireFlyMetadata.from_bytes(self._query("RD", i2c_address=self._i2c_addresses['metadata'], command=0x1000,
-                                                      length=0xC5))
+        if (metadata := self._take_prefetched_metadata()) is not None:
+            return metadata
+        return FireFlyMetadata.from_bytes(
+            self._read_at_pointer(self._i2c_addresses['metadata'], 0x0C01, b'\x00' * 2, 0x1000, length=0xC5))
 
     @property
     def metadata(self) -> FireFlyMetadata:
@@ -2,15 +2,20 @@ import configparser
 import datetime
 import re
 import sys
+from types import SimpleNamespace
 
 import pytest
 
+from pmk_probes._hardware_interfaces import SerialInterface
+from pmk_probes import power_supplies
 from pmk_probes.power_supplies import PS03, _PMKPowerSupply
 from pmk_probes.probes import *
 
 config = configparser.ConfigParser()
 config.read("config.ini")
 MOCK_ONLY = config.getboolean("general", "mock_only")
+# command frame sent by _query: STX, WR/RD, channel, I2C address, addressing, command + length (+ payload), ETX
+_MOCK_WRITE_RE = re.compile(rb'\x02(WR|RD)(\d)([0-9A-F]{2})[WB](.*?)\x03')
 
 
 def probe_class_from_name(name: str) -> type:
@@ -41,6 +46,17 @@ def get_config():
     return probe_class_from_config("devices.BumbleBee")
 
 
+@pytest.fixture
+def clear_discovery_caches():
+    """Start and end a test with empty discovery caches, they are module globals that outlive a single test."""
+    caches = (power_supplies._enumerations, power_supplies._lan_models, power_supplies._usb_power_supply_types)
+    for cache in caches:
+        cache.clear()
+    yield
+    for cache in caches:
+        cache.clear()
+
+
 @pytest.fixture(params=config.items(section="devices.PS.connection"))
 def ps(request):
     ps = PS03(**dict((request.param,)))
@@ -91,25 +107,45 @@ def power_over_fiber(ps):
 @pytest.fixture(autouse=False)
 def mock_communication(monkeypatch):
     sent = []
+    memories = {}  # (channel, I2C address) -> bytes returned by RD, RD to any other device is not answered
     return_buffer = bytearray()
+    read_pos = 0
 
     def mock_write(self, data: bytes):
         nonlocal return_buffer
         print(data)
-        string = data.decode('utf-8')
-
-        # Use regex to find the desired substring
-        match = re.search(r'(\x02)(WR|RD)(\d)\d{2}[WB](.*?)(\x03)', string)
-        return_buffer.extend(b'\x02\x06' + (match.group(3) + match.group(4)).encode('utf-8') + b'\x03')
+        sent.append(data)
+        # echo channel and command (+ payload) back like the power supply does
+        match = _MOCK_WRITE_RE.search(data)
+        wr_rd, channel, i2c_address, cmd = match.groups()
+        if wr_rd == b'RD':
+            memory = memories.get((int(channel), int(i2c_address, 16)))
+            if memory is None:  # no device at this address, e.g. an empty channel
+                return None
+            length = int(cmd[4:6], 16)
+            cmd += memory[:length].ljust(length, b'\xFF').hex().upper().encode()
+        return_buffer.extend(b'\x02\x06' + channel + cmd + b'\x03\r')
         return None
 
     def mock_read(self, data_length: int) -> bytes:
-        ans = return_buffer[:data_length]
-        return_buffer[:] = return_buffer[data_length:]
+        nonlocal read_pos
+        ans = return_buffer[read_pos:read_pos + data_length]
+        read_pos += len(ans)
+        # drop consumed bytes only once they make up most of the buffer
+        if read_pos > len(return_buffer) // 2:
+            del return_buffer[:read_pos]
+            read_pos = 0
         return ans
 
+    def mock_reset_input_buffer(self) -> None:
+        nonlocal read_pos
+        del return_buffer[:]
+        read_pos = 0
+
     monkeypatch.setattr(HardwareInterface, "write", mock_write)
     monkeypatch.setattr(HardwareInterface, "read", mock_read)
+    monkeypatch.setattr(SerialInterface, "reset_input_buffer", mock_reset_input_buffer)
+    yield SimpleNamespace(sent=sent, memories=memories)
 
 
 def metadata_factory(probe_model: str, old_variant: bool) -> bytes:
@@ -133,6 +169,23 @@ def metadata_factory(probe_model: str, old_variant: bool) -> bytes:
     return mock_probe_metadata.to_bytes()
 
 
+def power_supply_metadata_factory(model: str, manufacturer: str = "http://www.pmk.de") -> bytes:
+    mock_power_supply_metadata = PMKMetadata(
+        eeprom_layout_revision="1.2",
+        serial_number="1234",
+        manufacturer=manufacturer,
+        model=model,
+        description="power supply for unit tests",
+        production_date=datetime.datetime.now().date(),
+        calibration_due_date=None,
+        calibration_instance="PMK",
+        hardware_revision="1.0",
+        software_revision="1.0",
+        uuid=""
+    )
+    return mock_power_supply_metadata.to_bytes()
+
+
 if MOCK_ONLY:
     mock_params = [True]
 else:
@@ -1,8 +1,11 @@
 import datetime
 import logging
+from dataclasses import fields
 from typing import Any
 
-from pmk_probes._data_structures import PMKMetadata, PowerOverFiberMetadata, FireFlyMetadata
+import pytest
+
+from pmk_probes._data_structures import PMKMetadata, PowerOverFiberMetadata, FireFlyMetadata, UUIDs
 
 
 def test_normal_metadata() -> None:
@@ -45,3 +48,109 @@ def test_due_date_none() -> None:
             **kwargs
         )
         logging.info(metadata.to_bytes())
+
+
+def test_from_bytes_round_trip() -> None:
+    today = datetime.datetime.now()
+    metadata = PMKMetadata(
+        eeprom_layout_revision="1.2",
+        serial_number=f"{today.strftime('%m%y')}{100:03d}",
+        manufacturer="http://www.pmk.de",
+        model="BumbleBee",
+        description="Active differential probe",
+        production_date=today.date(),
+        calibration_due_date=None,
+        calibration_instance="PMK",
+        hardware_revision="M1.0 K0.7",
+        software_revision="M1.2 K2.4",
+        uuid="886-102-504"
+    )
+    assert PMKMetadata.from_bytes(metadata.to_bytes()) == metadata
+
+
+def test_to_bytes_after_field_change() -> None:
+    metadata = PMKMetadata(
+        eeprom_layout_revision="1.2",
+        serial_number="0000",
+        manufacturer="http://www.pmk.de",
+        model="BumbleBee",
+        description="Active differential probe",
+        production_date=datetime.date(2024, 1, 31),
+        calibration_due_date=None,
+        calibration_instance="PMK",
+        hardware_revision="M1.0 K0.7",
+        software_revision="M1.2 K2.4",
+        uuid="886-102-504"
+    )
+    original_bytes = metadata.to_bytes()
+    metadata.serial_number = "1234"
+    assert metadata.to_bytes() != original_bytes  # the cached byte representation must not be reused
+    assert PMKMetadata.from_bytes(metadata.to_bytes()).serial_number == "1234"
+
+
+def mapped_metadata_image(metadata: PowerOverFiberMetadata | FireFlyMetadata, length: int = 0x100) -> bytes:
+    """ Place every field at its address in its metadata map, like it is stored in the probe's EEPROM. """
+    image = bytearray(b"\xFF" * length)
+    meta_map = metadata.metadata_maps[metadata.eeprom_layout_revision.encode("ascii")]
+    for field_name, (address, _) in meta_map.items():
+        byte_field = metadata._unparse_field(field_name, getattr(metadata, field_name))
+        image[address:address + len(byte_field)] = byte_field
+    return bytes(image[:length])
+
+
+def mapped_metadata(constructor: type[PowerOverFiberMetadata | FireFlyMetadata], eeprom_layout_revision: str,
+                    **kwargs) -> PowerOverFiberMetadata | FireFlyMetadata:
+    return constructor(
+        eeprom_layout_revision=eeprom_layout_revision,
+        serial_number="1234",
+        manufacturer="http://www.pmk.de",
+        model="FireFly",
+        description="Optically isolated probing system",
+        production_date=datetime.datetime(2024, 1, 31),
+        calibration_due_date=datetime.datetime(2025, 1, 31),
+        calibration_instance="PMK",
+        hardware_revision="M0.00 BM0.03 LM0.01",
+        software_revision="M1.2 K2.4",
+        uuid=UUIDs.get_internal_value(constructor.__name__.removesuffix("Metadata")),
+        **kwargs
+    )
+
+
+@pytest.mark.parametrize(
+    "constructor, eeprom_layout_revision, kwargs",
+    [
+        (FireFlyMetadata, "1.1", {"propagation_delay": 1.5}),
+        (FireFlyMetadata, "1.2", {"propagation_delay": 1.5}),
+        (PowerOverFiberMetadata, "1.2", {}),
+    ]
+)
+def test_mapped_metadata_from_bytes(constructor, eeprom_layout_revision, kwargs) -> None:
+    metadata = mapped_metadata(constructor, eeprom_layout_revision, **kwargs)
+    parsed = constructor.from_bytes(mapped_metadata_image(metadata))
+    for field in fields(constructor):
+        if field.init:
+            assert getattr(parsed, field.name) == getattr(metadata, field.name)
+
+
+@pytest.mark.parametrize("eeprom_layout_revision, length", [("1.1", 0xBD), ("1.2", 0xC3), ("1.2", 0x50)])
+def test_short_firefly_metadata_from_bytes(eeprom_layout_revision, length) -> None:
+    metadata = mapped_metadata(FireFlyMetadata, eeprom_layout_revision, propagation_delay=1.5)
+    parsed = FireFlyMetadata.from_bytes(mapped_metadata_image(metadata, length))
+    assert parsed.serial_number == metadata.serial_number
+    assert parsed.propagation_delay is None  # cut off by the end of the metadata
+
+
+@pytest.mark.parametrize(
+    "constructor, eeprom_layout_revision",
+    [(FireFlyMetadata, b"1.1"), (FireFlyMetadata, b"1.2"), (PowerOverFiberMetadata, b"1.2")]
+)
+def test_layout_struct(constructor, eeprom_layout_revision) -> None:
+    meta_map = constructor.metadata_maps[eeprom_layout_revision]
+    layout, field_names = constructor._layout_struct(eeprom_layout_revision)
+    assert layout.size == max(address + length for address, length in meta_map.values())
+    assert sorted(field_names) == sorted(meta_map)
+    # every field is unpacked from its own address
+    image = bytes(range(layout.size))
+    for field_name, field_value in zip(field_names, layout.unpack(image)):
+        address, length = meta_map[field_name]
+        assert field_value == image[address:address + length]
@@ -1,4 +1,12 @@
-from pmk_probes.power_supplies import find_power_supplies
+from types import SimpleNamespace
+
+import pytest
+import serial.tools.list_ports
+
+from pmk_probes import power_supplies
+from pmk_probes._devices import Channel
+from pmk_probes.power_supplies import find_power_supplies, PS02, PS08, _ENUMERATION_TTL, _PMKPowerSupply
+from .conftest import metadata_factory, power_supply_metadata_factory, probe_class_from_name
 
 
 class TestPMKPowerSupply:
@@ -15,10 +23,116 @@ class TestPMKPowerSupply:
         connected_probes = ps.connected_probes
         print(connected_probes)
 
+    @pytest.mark.parametrize("probe_model", ["BumbleBee2kV", "BumbleBee1kV", "HSDP2010", "HSDP2025"])
+    def test_detect_probe(self, ps, mock_communication, probe_model):
+        probe_type = probe_class_from_name(probe_model)
+        mock_communication.memories[(1, probe_type._i2c_addresses["metadata"])] = metadata_factory(probe_model, False)
+        detected_probe = ps._detect_probe(Channel.CH1)
+        assert type(detected_probe) is probe_type  # selected by the UUID in the metadata
+        assert ps._detect_probe(Channel.CH2) is None  # nothing connected
+        assert [type(probe) for probe in ps.connected_probes] == [probe_type]
+
+    @pytest.mark.parametrize("probe_model", ["BumbleBee1kV", "HSDP2025"])
+    def test_detect_probe_reads_metadata_once(self, ps, mock_communication, probe_model):
+        probe_type = probe_class_from_name(probe_model)
+        i2c_address = probe_type._i2c_addresses["metadata"]
+        mock_communication.memories[(1, i2c_address)] = metadata_factory(probe_model, False)
+        ps._detect_probe(Channel.CH1)
+        metadata_read = f"\x02RD1{i2c_address:02X}".encode()
+        metadata_reads = [data for data in mock_communication.sent if data.startswith(metadata_read)]
+        assert len(metadata_reads) == 1  # the detected probe reuses the metadata read while detecting it
+
+    def test_detected_probe_rereads_metadata(self, ps, mock_communication):
+        mock_communication.memories[(1, 0x04)] = metadata_factory("BumbleBee1kV", False)
+        detected_probe = ps._detect_probe(Channel.CH1)
+        mock_communication.memories[(1, 0x04)] = metadata_factory("BumbleBee1kV", True)
+        detected_probe._read_metadata.cache_clear()
+        assert detected_probe.metadata.software_revision == "M1.0 K2.4"  # read again instead of the detection's
+
+    @pytest.mark.parametrize("manufacturer, read_lengths", [
+        ("http://www.pmk.de", ["40"]),  # the model ends within the first bytes
+        ("http://www.pmk.de/" + "x" * 62, ["40", "FF"]),  # the model is cut off, the whole metadata is read
+    ])
+    def test_read_identity(self, ps, mock_communication, manufacturer, read_lengths):
+        mock_communication.memories[(0, 0x04)] = power_supply_metadata_factory("PS-03", manufacturer)
+        assert ps._read_identity() == ("PS-03", "1234")
+        assert mock_communication.sent == [f"\x02RD004W0000{length}\x03".encode() for length in read_lengths]
+
     def test_power_supply_repr(self, ps):
         assert repr(ps) == f"{ps.__class__.__name__}({next(iter(ps._interface.connection_info))}={ps._interface})"
 
 
+@pytest.mark.usefixtures("clear_discovery_caches")
 def test_find_power_supplies():
     print(find_power_supplies())
     assert len(find_power_supplies()) > 0
+
+
+@pytest.mark.usefixtures("clear_discovery_caches")
+def test_enumeration_cache(monkeypatch):
+    now = 100.0
+    comports_calls = []
+
+    def mock_comports():
+        comports_calls.append(now)
+        return [SimpleNamespace(device="COM1", serial_number="A", vid=0x0403, pid=0x6001)]
+
+    monkeypatch.setattr(serial.tools.list_ports, "comports", mock_comports)
+    monkeypatch.setattr(power_supplies.time, "monotonic", lambda: now)
+    assert power_supplies._enumerate_usb() == [("COM1", "A")]
+    assert power_supplies._enumerate_usb() == [("COM1", "A")]
+    assert len(comports_calls) == 1  # reused within the TTL
+    now += _ENUMERATION_TTL
+    power_supplies._enumerate_usb()
+    assert len(comports_calls) == 2  # expired
+    power_supplies._enumerate_usb(force=True)
+    assert len(comports_calls) == 3  # forced
+
+
+@pytest.mark.usefixtures("clear_discovery_caches")
+def test_find_power_supplies_force(monkeypatch):
+    comports_calls = []
+    lan_forced = []
+    monkeypatch.setattr(serial.tools.list_ports, "comports", lambda: comports_calls.append(None) or [])
+    monkeypatch.setattr(power_supplies, "_find_power_supplies_lan", lambda force: lan_forced.append(force) or [])
+    find_power_supplies()
+    find_power_supplies()
+    assert len(comports_calls) == 1
+    find_power_supplies(force=True)
+    assert len(comports_calls) == 2  # the cached enumeration is bypassed
+    assert lan_forced == [False, False, True]
+
+
+@pytest.mark.usefixtures("clear_discovery_caches")
+def test_usb_power_supply_types_cache(monkeypatch):
+    now = 100.0
+    ports = {"COM1": "PS-02", "COM2": "PS-08"}  # attached COM port -> model
+    queried_ports = []
+
+    def mock_query(self, wr_rd, i2c_address, command, payload=None, length=0xFF):
+        com_port = self._interface.connection_info["com_port"]
+        queried_ports.append(com_port)
+        return power_supply_metadata_factory(ports[com_port])[:length]
+
+    monkeypatch.setattr(serial.tools.list_ports, "comports", lambda: [
+        SimpleNamespace(device=port, serial_number=port[-1], vid=0x0403, pid=0x6001) for port in ports
+    ])
+    monkeypatch.setattr(_PMKPowerSupply, "_query", mock_query)
+    monkeypatch.setattr(power_supplies.time, "monotonic", lambda: now)
+    assert [type(ps) for ps in power_supplies._find_power_supplies_usb()] == [PS02, PS08]
+    assert sorted(queried_ports) == ["COM1", "COM2"]
+    queried_ports.clear()
+    assert [type(ps) for ps in power_supplies._find_power_supplies_usb()] == [PS02, PS08]
+    assert queried_ports == []  # models are known
+    # unplug COM2 and plug it in again, whatever is attached then is read again
+    del ports["COM2"]
+    now += _ENUMERATION_TTL
+    assert [type(ps) for ps in power_supplies._find_power_supplies_usb()] == [PS02]
+    assert ("COM2", "2") not in power_supplies._usb_power_supply_types
+    ports["COM2"] = "PS-02"
+    now += _ENUMERATION_TTL
+    assert [type(ps) for ps in power_supplies._find_power_supplies_usb()] == [PS02, PS02]
+    assert queried_ports == ["COM2"]
+    queried_ports.clear()
+    power_supplies._find_power_supplies_usb(force=True)
+    assert sorted(queried_ports) == ["COM1", "COM2"]